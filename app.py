@@ -1,97 +1,280 @@
-from flask import Flask, request, jsonify, render_template, session, redirect, url_for
+from flask import Flask, Response, request, jsonify, render_template, session, redirect, url_for, stream_with_context
+from flask.json.provider import JSONProvider
 from datetime import datetime
-import requests
+from decimal import Decimal
+import httpx
+import itertools
+import msgspec
+import orjson
 import os
+import queue
+import threading
+import time
+import weakref
+import atexit
+import logging
+import logging.handlers
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from functools import wraps
 from urllib.parse import urlparse
 
+# ==================== LOGGING ====================
+# Handlers only enqueue records; a listener thread does the stdout writes
+_log_queue = queue.Queue(-1)
+_log_listener = logging.handlers.QueueListener(_log_queue, logging.StreamHandler(sys.stdout))
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(message)s',
+    handlers=[logging.handlers.QueueHandler(_log_queue)]
+)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+logger = logging.getLogger('balance_monitor')
+
+# ==================== JSON ====================
+def _orjson_default(obj):
+    """Serialize types orjson doesn't handle natively (PostgreSQL DECIMAL columns)"""
+    if isinstance(obj, Decimal):
+        return str(obj)
+    raise TypeError
+
+def to_json(obj):
+    """Serialize obj straight to UTF-8 JSON bytes"""
+    return orjson.dumps(obj, default=_orjson_default)
+
+class ORJSONProvider(JSONProvider):
+    """Flask JSON provider backed by orjson"""
+    
+    def dumps(self, obj, **kwargs):
+        return to_json(obj).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        # Skip the str round-trip in JSONProvider.response()
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(to_json(obj), mimetype='application/json')
+
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
+app.json = ORJSONProvider(app)
 
 # ==================== CONFIGURATION ====================
 TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', '')
 TELEGRAM_CHAT_ID = os.environ.get('TELEGRAM_CHAT_ID', '')
+TELEGRAM_ENABLED = bool(TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID)
+TELEGRAM_URL = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage" if TELEGRAM_ENABLED else None
+TELEGRAM_HEADERS = {"Content-Type": "application/json"}
 DASHBOARD_PASSWORD = os.environ.get('DASHBOARD_PASSWORD', 'admin123')
 DATABASE_URL = os.environ.get('DATABASE_URL', '')
 
+# ==================== PAYLOAD SCHEMA ====================
+class Update(msgspec.Struct):
+    """Balance update posted by the MT5 EA, decoded and validated in one pass"""
+    account_label: str
+    account_number: str | int
+    new_balance: float
+    timestamp: str
+    event_type: str | None = None
+    broker: str | None = None
+    currency: str | None = None
+    
+    def __post_init__(self):
+        # EAs may send the login as a number; it is stored as text either way
+        self.account_number = str(self.account_number)
+
 # Detect database type
 USE_POSTGRES = bool(DATABASE_URL and 'postgres' in DATABASE_URL)
 
 if USE_POSTGRES:
-    import psycopg2
-    from psycopg2.extras import RealDictCursor
-    print("📊 Using PostgreSQL database")
+    from psycopg2.pool import ThreadedConnectionPool
+    logger.info("📊 Using PostgreSQL database")
 else:
     import sqlite3
     DATABASE_NAME = "balance_monitor.db"
-    print("📊 Using SQLite database")
+    logger.info("📊 Using SQLite database")
 
 # ==================== DATABASE CONNECTION ====================
+# ThreadedConnectionPool raises instead of blocking when empty, so keep
+# PG_POOL_MAX at or above gunicorn's --threads (see Procfile) plus UPDATE_WORKERS.
+# putconn() only keeps PG_POOL_MIN idle connections and closes the rest, so
+# PG_POOL_MIN defaults to PG_POOL_MAX to stop reconnecting under load.
+PG_POOL_MAX = int(os.environ.get('PG_POOL_MAX', 12))
+PG_POOL_MIN = int(os.environ.get('PG_POOL_MIN', PG_POOL_MAX))
+
+if USE_POSTGRES:
+    # Built on first borrow, so the app still boots (and /health answers) while
+    # PostgreSQL is down; a failed build is retried on the next borrow
+    PG_POOL = None
+    _PG_POOL_LOCK = threading.Lock()
+else:
+    # SQLite connections can't be shared across threads, keep one per thread
+    _sqlite_local = threading.local()
+    
+    # Per-connection tuning; journal_mode=WAL is persistent and set in init_database()
+    SQLITE_PRAGMAS = (
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA mmap_size=268435456",
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA cache_size=-64000",
+    )
+
+def _get_pg_pool():
+    """Return the PostgreSQL pool, creating it on first use"""
+    global PG_POOL
+    if PG_POOL is None:
+        with _PG_POOL_LOCK:
+            if PG_POOL is None:
+                # Fix for Railway PostgreSQL connection string
+                PG_POOL = ThreadedConnectionPool(
+                    PG_POOL_MIN, PG_POOL_MAX,
+                    DATABASE_URL.replace('postgres://', 'postgresql://')
+                )
+    return PG_POOL
+
+def _borrow_pg_connection():
+    """Take a pooled connection, replacing any the server has already dropped"""
+    pool = _get_pg_pool()
+    for _ in range(PG_POOL_MAX):
+        conn = pool.getconn()
+        try:
+            # Non-blocking read; picks up a server-side disconnect (idle timeout,
+            # restart) without a round-trip
+            conn.poll()
+            if not conn.closed:
+                return conn
+        except Exception:
+            pass
+        pool.putconn(conn, close=True)
+    return pool.getconn()
+
+@contextmanager
 def get_db_connection():
-    """Get database connection based on environment"""
+    """Borrow a database connection (pooled for PostgreSQL, per-thread for SQLite)"""
     if USE_POSTGRES:
-        # Fix for Railway PostgreSQL connection string
-        url = DATABASE_URL.replace('postgres://', 'postgresql://')
-        return psycopg2.connect(url)
+        conn = _borrow_pg_connection()
+        discard = False
+        try:
+            yield conn
+        finally:
+            # Never hand a connection stuck in a failed transaction back to the pool
+            try:
+                if not conn.closed:
+                    conn.rollback()
+            except Exception:
+                discard = True
+            finally:
+                # psycopg2 marks a connection closed when its socket has failed
+                PG_POOL.putconn(conn, close=discard or bool(conn.closed))
     else:
-        return sqlite3.connect(DATABASE_NAME)
+        conn = getattr(_sqlite_local, 'conn', None)
+        if conn is None:
+            # Autocommit mode: writers open their own transactions with BEGIN
+            conn = sqlite3.connect(DATABASE_NAME, isolation_level=None)
+            for pragma in SQLITE_PRAGMAS:
+                conn.execute(pragma)
+            _sqlite_local.conn = conn
+        try:
+            yield conn
+        finally:
+            conn.rollback()
 
 # ==================== DATABASE SETUP ====================
+_DB_READY = False
+
 def init_database():
     """Initialize database with proper schema"""
+    global _DB_READY
     try:
         if USE_POSTGRES:
-            conn = get_db_connection()
-            cursor = conn.cursor()
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
             
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS balance_history (
-                    id SERIAL PRIMARY KEY,
-                    timestamp TIMESTAMP NOT NULL,
-                    account_label VARCHAR(255) NOT NULL,
-                    account_number VARCHAR(50) NOT NULL,
-                    balance DECIMAL(15, 2) NOT NULL,
-                    event_type VARCHAR(50),
-                    broker VARCHAR(255),
-                    currency VARCHAR(10),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS balance_history (
+                        id SERIAL PRIMARY KEY,
+                        timestamp TIMESTAMP NOT NULL,
+                        account_label VARCHAR(255) NOT NULL,
+                        account_number VARCHAR(50) NOT NULL,
+                        balance DECIMAL(15, 2) NOT NULL,
+                        event_type VARCHAR(50),
+                        broker VARCHAR(255),
+                        currency VARCHAR(10),
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
             
-            # Create index for faster queries
-            cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_account_label 
-                ON balance_history(account_label, account_number, created_at DESC)
-            ''')
+                # Covering index so the previous-balance lookup is index-only
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_prev_balance 
+                    ON balance_history(account_label, account_number, created_at DESC)
+                    INCLUDE (balance)
+                ''')
+                # Superseded by idx_prev_balance
+                cursor.execute('DROP INDEX IF EXISTS idx_account_label')
+                
+                # Timestamp range filter used by /api/history
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_history_ts 
+                    ON balance_history(timestamp)
+                ''')
             
-            conn.commit()
-            cursor.close()
-            conn.close()
-            print("✓ PostgreSQL database initialized successfully")
+                conn.commit()
+                cursor.close()
+            _DB_READY = True
+            logger.info("✓ PostgreSQL database initialized successfully")
         else:
-            conn = get_db_connection()
-            cursor = conn.cursor()
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
+                
+                # WAL lets /api/history read while an update is being written
+                cursor.execute("PRAGMA journal_mode=WAL")
             
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS balance_history (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp TEXT NOT NULL,
-                    account_label TEXT NOT NULL,
-                    account_number TEXT NOT NULL,
-                    balance REAL NOT NULL,
-                    event_type TEXT,
-                    broker TEXT,
-                    currency TEXT,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS balance_history (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        timestamp TEXT NOT NULL,
+                        account_label TEXT NOT NULL,
+                        account_number TEXT NOT NULL,
+                        balance REAL NOT NULL,
+                        event_type TEXT,
+                        broker TEXT,
+                        currency TEXT,
+                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+                
+                # SQLite has no INCLUDE, so balance is a trailing key column to keep it covering
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_prev_balance 
+                    ON balance_history(account_label, account_number, created_at DESC, balance)
+                ''')
+                
+                # Timestamp range filter used by /api/history
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_history_ts 
+                    ON balance_history(timestamp)
+                ''')
             
-            conn.commit()
-            conn.close()
-            print("✓ SQLite database initialized successfully")
+                conn.commit()
+            _DB_READY = True
+            logger.info("✓ SQLite database initialized successfully")
             
     except Exception as e:
-        print(f"✗ Database initialization error: {str(e)}")
+        logger.error("✗ Database initialization error: %s", e)
+
+def ensure_database():
+    """Initialize the schema only if startup initialization did not succeed"""
+    if not _DB_READY:
+        init_database()
+
+# Run once per process so gunicorn workers are initialized too
+with app.app_context():
+    init_database()
 
 # ==================== AUTHENTICATION ====================
 def login_required(f):
@@ -103,168 +286,298 @@ def login_required(f):
     return decorated_function
 
 # ==================== HELPER FUNCTIONS ====================
-def get_previous_balance(account_label, account_number):
-    """Get the most recent balance for an account from database"""
-    try:
-        conn = get_db_connection()
-        
-        if USE_POSTGRES:
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute('''
-                SELECT balance 
-                FROM balance_history 
-                WHERE account_label = %s AND account_number = %s
-                ORDER BY created_at DESC
-                LIMIT 1
-            ''', (account_label, account_number))
-        else:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT balance 
-                FROM balance_history 
-                WHERE account_label = ? AND account_number = ?
-                ORDER BY created_at DESC
-                LIMIT 1
-            ''', (account_label, account_number))
-        
-        result = cursor.fetchone()
-        cursor.close()
-        conn.close()
-        
-        if USE_POSTGRES:
-            return result['balance'] if result else None
-        else:
-            return result[0] if result else None
-        
-    except Exception as e:
-        print(f"✗ Error getting previous balance: {str(e)}")
-        return None
+# Most recent balance per (account_label, account_number). Only this service
+# writes balance_history, so the cache stays correct within a process.
+_LAST_BALANCE = {}
+_LAST_BALANCE_LOCK = threading.Lock()
+
+# Serialized /api/accounts response, refreshed after ACCOUNTS_CACHE_TTL seconds
+# or as soon as an update arrives for an account this process hasn't seen
+ACCOUNTS_CACHE_TTL = 60
+# 'generation' is bumped on every new account so a query that started before
+# the bump can't store its (now stale) result
+_ACCOUNTS_CACHE = {'json_bytes': None, 'expires': 0, 'generation': 0}
+_ACCOUNTS_CACHE_LOCK = threading.Lock()
 
 # ==================== TELEGRAM MODULE ====================
-def send_to_telegram(payload, previous_balance=None):
-    """Send balance update notification to Telegram"""
-    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
-        print("⚠️  Telegram not configured - skipping notification")
+# Shared HTTP/2 client keeps one multiplexed connection to api.telegram.org alive
+TG_CLIENT = httpx.Client(http2=True, timeout=10.0, limits=httpx.Limits(max_keepalive_connections=2))
+# httpx logs every request URL at INFO, and ours contains the bot token
+logging.getLogger('httpx').setLevel(logging.WARNING)
+
+# Updates already waiting when the worker wakes up are combined into one message
+# of at most TELEGRAM_MESSAGE_LIMIT characters (Telegram's own limit)
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+def _fmt(x):
+    return format(x, ',.2f')
+
+def format_telegram_message(update, previous_balance=None):
+    """Format message: Account label // previous --> current"""
+    if previous_balance is not None:
+        return f"{update.account_label} // {_fmt(previous_balance)} --> {_fmt(update.new_balance)}"
+    return f"{update.account_label} // {_fmt(update.new_balance)}"
+
+def send_telegram_message(message):
+    """Send a text message to the configured Telegram chat"""
+    if not TELEGRAM_ENABLED:
         return False
         
     try:
-        account_label = payload.get('account_label', 'Unknown')
-        new_balance = payload.get('new_balance', 0.0)
-        
-        # Format message: Account label // previous --> current
-        if previous_balance is not None:
-            message = f"{account_label} // {previous_balance:,.2f} --> {new_balance:,.2f}"
-        else:
-            message = f"{account_label} // {new_balance:,.2f}"
-        
-        url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-        data = {
+        data = orjson.dumps({
             "chat_id": TELEGRAM_CHAT_ID,
             "text": message
-        }
+        })
         
-        response = requests.post(url, json=data, timeout=10)
+        response = TG_CLIENT.post(TELEGRAM_URL, content=data, headers=TELEGRAM_HEADERS)
         
         if response.status_code == 200:
-            print("✓ Telegram notification sent successfully")
+            logger.info("✓ Telegram notification sent successfully")
             return True
         else:
-            print(f"✗ Telegram error: {response.status_code}")
+            logger.error("✗ Telegram error: %s", response.status_code)
             return False
             
     except Exception as e:
-        print(f"✗ Telegram exception: {str(e)}")
+        logger.error("✗ Telegram exception: %s", e)
         return False
 
+# Notifications are sent off the request path so the EA isn't kept waiting on Telegram
+TELEGRAM_QUEUE = queue.Queue()
+
+def _telegram_length(text):
+    # Telegram counts UTF-16 code units, so characters outside the BMP count twice
+    return len(text.encode('utf-16-le')) // 2
+
+def telegram_worker():
+    """Drain TELEGRAM_QUEUE, sending queued (update, previous_balance) items in batches"""
+    carry = None
+    while True:
+        if carry is None:
+            carry = format_telegram_message(*TELEGRAM_QUEUE.get())
+        lines = [carry]
+        length = _telegram_length(carry)
+        carry = None
+        while True:
+            try:
+                line = format_telegram_message(*TELEGRAM_QUEUE.get_nowait())
+            except queue.Empty:
+                break
+            line_length = _telegram_length(line)
+            if length + 1 + line_length > TELEGRAM_MESSAGE_LIMIT:
+                # Doesn't fit; it starts the next message
+                carry = line
+                break
+            lines.append(line)
+            length += 1 + line_length
+        try:
+            send_telegram_message("\n".join(lines))
+        finally:
+            for _ in lines:
+                TELEGRAM_QUEUE.task_done()
+
+if TELEGRAM_ENABLED:
+    threading.Thread(target=telegram_worker, name='telegram-worker', daemon=True).start()
+else:
+    logger.warning("⚠️  Telegram not configured - notifications disabled")
+
 # ==================== DATABASE MODULE ====================
-def log_to_database(payload):
-    """Log balance update to database"""
+# PostgreSQL inserts are parsed and planned once per connection, then EXECUTEd
+PG_PREPARE_SQL = (
+    '''
+        PREPARE insert_balance (timestamp, varchar, varchar, numeric, varchar, varchar, varchar) AS
+        INSERT INTO balance_history 
+        (timestamp, account_label, account_number, balance, event_type, broker, currency)
+        VALUES ($1, $2, $3, $4, $5, $6, $7)
+    ''',
+    # The CTE sees the table as it was before this INSERT
+    '''
+        PREPARE insert_balance_prev (timestamp, varchar, varchar, numeric, varchar, varchar, varchar) AS
+        WITH prev AS (
+            SELECT balance
+            FROM balance_history
+            WHERE account_label = $2 AND account_number = $3
+            ORDER BY created_at DESC
+            LIMIT 1
+        )
+        INSERT INTO balance_history 
+        (timestamp, account_label, account_number, balance, event_type, broker, currency)
+        VALUES ($1, $2, $3, $4, $5, $6, $7)
+        RETURNING (SELECT balance FROM prev) AS previous_balance
+    ''',
+)
+_PREPARED_CONNECTIONS = weakref.WeakSet()
+
+def prepare_statements(conn):
+    """PREPARE the insert statements on a pooled PostgreSQL connection if not done yet"""
+    if conn in _PREPARED_CONNECTIONS:
+        return
+    # Autocommit and one multi-statement execute: a single round-trip, outside
+    # any transaction, so a later rollback on this connection can't undo it
+    conn.autocommit = True
     try:
-        # Ensure database exists
-        init_database()
+        cursor = conn.cursor()
+        cursor.execute(';'.join(PG_PREPARE_SQL))
+        cursor.close()
+    finally:
+        conn.autocommit = False
+    _PREPARED_CONNECTIONS.add(conn)
+
+def log_to_database(update, return_previous=False):
+    """Log balance update to database
+    
+    With return_previous=True the account's previous balance is taken from
+    the in-process cache, or read in the same round-trip on a cache miss,
+    and (success, previous_balance) is returned.
+    """
+    key = (update.account_label, update.account_number)
+    previous_balance = None
+    lookup_previous = False
+    if return_previous:
+        with _LAST_BALANCE_LOCK:
+            if key in _LAST_BALANCE:
+                previous_balance = _LAST_BALANCE[key]
+            else:
+                lookup_previous = True
+    
+    try:
+        ensure_database()
         
-        conn = get_db_connection()
+        params = (
+            update.timestamp,
+            update.account_label,
+            update.account_number,
+            update.new_balance,
+            update.event_type,
+            update.broker,
+            update.currency
+        )
         
-        if USE_POSTGRES:
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO balance_history 
-                (timestamp, account_label, account_number, balance, event_type, broker, currency)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-            ''', (
-                payload.get('timestamp'),
-                payload.get('account_label'),
-                payload.get('account_number'),
-                payload.get('new_balance'),
-                payload.get('event_type'),
-                payload.get('broker'),
-                payload.get('currency')
-            ))
-        else:
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO balance_history 
-                (timestamp, account_label, account_number, balance, event_type, broker, currency)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                payload.get('timestamp'),
-                payload.get('account_label'),
-                payload.get('account_number'),
-                payload.get('new_balance'),
-                payload.get('event_type'),
-                payload.get('broker'),
-                payload.get('currency')
-            ))
+        with get_db_connection() as conn:
+            if USE_POSTGRES:
+                cursor = conn.cursor()
+                prepare_statements(conn)
+                if lookup_previous:
+                    cursor.execute('EXECUTE insert_balance_prev (%s, %s, %s, %s, %s, %s, %s)', params)
+                    previous_balance = cursor.fetchone()[0]
+                else:
+                    cursor.execute('EXECUTE insert_balance (%s, %s, %s, %s, %s, %s, %s)', params)
+            else:
+                cursor = conn.cursor()
+                # IMMEDIATE takes the write lock up front; a deferred BEGIN that reads first
+                # fails with SQLITE_BUSY instead of waiting if another writer commits meanwhile
+                cursor.execute("BEGIN IMMEDIATE")
+                if lookup_previous:
+                    # Local file, so a SELECT in the same transaction costs no round-trip
+                    cursor.execute('''
+                        SELECT balance 
+                        FROM balance_history 
+                        WHERE account_label = ? AND account_number = ?
+                        ORDER BY created_at DESC
+                        LIMIT 1
+                    ''', key)
+                    result = cursor.fetchone()
+                    previous_balance = result[0] if result else None
+                cursor.execute('''
+                    INSERT INTO balance_history 
+                    (timestamp, account_label, account_number, balance, event_type, broker, currency)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', params)
         
-        conn.commit()
-        cursor.close()
-        conn.close()
-        print("✓ Data logged to database successfully")
-        return True
+            conn.commit()
+            cursor.close()
+        
+        with _LAST_BALANCE_LOCK:
+            new_account = key not in _LAST_BALANCE
+            _LAST_BALANCE[key] = update.new_balance
+        if new_account:
+            with _ACCOUNTS_CACHE_LOCK:
+                _ACCOUNTS_CACHE['generation'] += 1
+                _ACCOUNTS_CACHE['expires'] = 0
+        logger.info("✓ Data logged to database successfully")
+        success = True
         
     except Exception as e:
-        print(f"✗ Database exception: {str(e)}")
-        return False
+        logger.error("✗ Database exception: %s", e)
+        success = False
+    
+    if return_previous:
+        return success, previous_balance
+    return success
+
+# ==================== UPDATE PROCESSING ====================
+# Updates are processed in the background. Each account always maps to the same
+# single-thread executor, so its updates are stored and compared in arrival order.
+# Non-daemon threads: queued updates are still written on a clean shutdown.
+UPDATE_WORKERS = 4
+UPDATE_EXECUTORS = [
+    ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'update-worker-{i}')
+    for i in range(UPDATE_WORKERS)
+]
+
+def process_update(update):
+    """Store a balance update and queue its Telegram notification"""
+    try:
+        # Log to Database, reading the previous balance in the same round-trip
+        db_success, previous_balance = log_to_database(update, return_previous=True)
+        if not db_success:
+            # The EA already got its 202, so retry once before the row is lost.
+            # A connection that failed is discarded, so this borrows another.
+            logger.warning("⚠️  Retrying database write for %s (%s)", update.account_label, update.account_number)
+            db_success, retry_previous = log_to_database(update, return_previous=True)
+            if previous_balance is None:
+                previous_balance = retry_previous
+            if not db_success:
+                logger.error(
+                    "✗ Dropped balance update after retry: %s (%s) balance=%s time=%s",
+                    update.account_label,
+                    update.account_number,
+                    update.new_balance,
+                    update.timestamp
+                )
+        
+        # Queue Telegram notification with previous balance
+        if TELEGRAM_ENABLED:
+            TELEGRAM_QUEUE.put((update, previous_balance))
+    except Exception as e:
+        logger.error("✗ Update processing error: %s", e)
+
+def submit_update(update):
+    """Hand a balance update to the executor that owns its account"""
+    key = (update.account_label, update.account_number)
+    UPDATE_EXECUTORS[hash(key) % UPDATE_WORKERS].submit(process_update, update)
 
 # ==================== API ENDPOINT ====================
 @app.route('/api/balance_update', methods=['POST'])
 def balance_update():
     """Main API endpoint to receive balance updates from MT5 EA"""
     try:
-        payload = request.get_json()
+        body = request.get_data()
         
-        if not payload:
+        if not body:
             return jsonify({"status": "error", "message": "No JSON data received"}), 400
         
-        print("\n" + "="*60)
-        print("📥 NEW BALANCE UPDATE RECEIVED")
-        print("="*60)
-        print(f"Account: {payload.get('account_label')} ({payload.get('account_number')})")
-        print(f"Balance: {payload.get('new_balance')}")
-        print(f"Event: {payload.get('event_type')}")
-        print(f"Time: {payload.get('timestamp')}")
-        print("="*60 + "\n")
+        try:
+            update = msgspec.json.decode(body, type=Update)
+        except msgspec.DecodeError as e:
+            # ValidationError is a DecodeError subclass, so this covers bad fields too
+            return jsonify({"status": "error", "message": str(e)}), 400
         
-        # Get previous balance from database
-        previous_balance = get_previous_balance(
-            payload.get('account_label'),
-            payload.get('account_number')
+        logger.info(
+            "📥 Balance update: %s (%s) balance=%s event=%s time=%s",
+            update.account_label,
+            update.account_number,
+            update.new_balance,
+            update.event_type,
+            update.timestamp
         )
         
-        # Send to Telegram with previous balance
-        telegram_success = send_to_telegram(payload, previous_balance)
-        
-        # Log to Database
-        db_success = log_to_database(payload)
+        submit_update(update)
         
-        return jsonify({
-            "status": "success",
-            "telegram_sent": telegram_success,
-            "database_logged": db_success
-        }), 200
+        return jsonify({"status": "accepted"}), 202
         
     except Exception as e:
-        print(f"✗ API error: {str(e)}")
+        logger.error("✗ API error: %s", e)
         return jsonify({"status": "error", "message": str(e)}), 500
 
 # ==================== WEB DASHBOARD ====================
@@ -296,111 +609,126 @@ def dashboard():
 @login_required
 def get_accounts():
     """Get list of all accounts"""
+    if time.monotonic() < _ACCOUNTS_CACHE['expires']:
+        return Response(_ACCOUNTS_CACHE['json_bytes'], mimetype='application/json')
+    
+    generation = _ACCOUNTS_CACHE['generation']
+    
     try:
-        # Ensure database exists
-        init_database()
+        ensure_database()
         
-        conn = get_db_connection()
+        with get_db_connection() as conn:
+            if USE_POSTGRES:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT DISTINCT account_label, account_number 
+                    FROM balance_history 
+                    ORDER BY account_label
+                ''')
+                accounts = [{"label": row[0], "number": row[1]} for row in cursor.fetchall()]
+            else:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT DISTINCT account_label, account_number 
+                    FROM balance_history 
+                    ORDER BY account_label
+                ''')
+                accounts = [{"label": row[0], "number": row[1]} for row in cursor.fetchall()]
         
-        if USE_POSTGRES:
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute('''
-                SELECT DISTINCT account_label, account_number 
-                FROM balance_history 
-                ORDER BY account_label
-            ''')
-            accounts = [{"label": row['account_label'], "number": row['account_number']} for row in cursor.fetchall()]
-        else:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT DISTINCT account_label, account_number 
-                FROM balance_history 
-                ORDER BY account_label
-            ''')
-            accounts = [{"label": row[0], "number": row[1]} for row in cursor.fetchall()]
-        
-        cursor.close()
-        conn.close()
+            cursor.close()
         
-        return jsonify(accounts)
+        json_bytes = to_json(accounts)
+        with _ACCOUNTS_CACHE_LOCK:
+            # A new account committed during the query; leave the cache expired
+            if _ACCOUNTS_CACHE['generation'] == generation:
+                _ACCOUNTS_CACHE['json_bytes'] = json_bytes
+                _ACCOUNTS_CACHE['expires'] = time.monotonic() + ACCOUNTS_CACHE_TTL
+        return Response(json_bytes, mimetype='application/json')
     except Exception as e:
-        print(f"✗ Error getting accounts: {str(e)}")
+        logger.error("✗ Error getting accounts: %s", e)
         return jsonify({"error": str(e)}), 500
 
+# Rows fetched and serialized per chunk when streaming /api/history
+HISTORY_CHUNK_SIZE = 2000
+HISTORY_COLUMNS = ("timestamp", "account_label", "account_number", "balance", "event_type", "broker", "currency")
+HISTORY_QUERY = f"SELECT {', '.join(HISTORY_COLUMNS)} FROM balance_history WHERE 1=1"
+
 @app.route('/api/history')
 @login_required
 def get_history():
-    """Get balance history with optional filters"""
+    """Get balance history with optional filters, streamed as a JSON array"""
     try:
-        # Ensure database exists
-        init_database()
+        ensure_database()
         
         account_labels = request.args.get('accounts', '').split(',')
         start_date = request.args.get('start_date')
         end_date = request.args.get('end_date')
         
-        conn = get_db_connection()
+        def generate():
+            with get_db_connection() as conn:
+                if USE_POSTGRES:
+                    # Named (server-side) cursor so rows arrive in chunks, not all at once
+                    cursor = conn.cursor(name='history_stream')
+                    query = HISTORY_QUERY
+                    params = []
+                
+                    if account_labels and account_labels[0]:
+                        # One array parameter keeps the SQL text fixed for any number of accounts
+                        query += " AND account_label = ANY(%s)"
+                        params.append(account_labels)
+                
+                    if start_date:
+                        query += " AND timestamp >= %s"
+                        params.append(start_date)
+                    if end_date:
+                        query += " AND timestamp <= %s"
+                        params.append(end_date + " 23:59:59")
+                
+                    query += " ORDER BY timestamp ASC"
+                    cursor.execute(query, params)
+                
+                else:
+                    cursor = conn.cursor()
+                    query = HISTORY_QUERY
+                    params = []
+                
+                    if account_labels and account_labels[0]:
+                        query += " AND account_label IN (SELECT value FROM json_each(?))"
+                        params.append(to_json(account_labels).decode())
+                
+                    if start_date:
+                        query += " AND timestamp >= ?"
+                        params.append(start_date)
+                    if end_date:
+                        query += " AND timestamp <= ?"
+                        params.append(end_date + " 23:59:59")
+                
+                    query += " ORDER BY timestamp ASC"
+                    cursor.execute(query, params)
+                
+                yield b'['
+                separator = b''
+                while True:
+                    rows = cursor.fetchmany(HISTORY_CHUNK_SIZE)
+                    if not rows:
+                        break
+                    # Serialize the whole chunk in one call and drop its brackets
+                    yield separator + to_json([dict(zip(HISTORY_COLUMNS, row)) for row in rows])[1:-1]
+                    separator = b','
+                yield b']'
+                
+                cursor.close()
         
-        if USE_POSTGRES:
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            query = "SELECT timestamp, account_label, account_number, balance, event_type, broker, currency FROM balance_history WHERE 1=1"
-            params = []
-            
-            if account_labels and account_labels[0]:
-                placeholders = ','.join(['%s'] * len(account_labels))
-                query += f" AND account_label IN ({placeholders})"
-                params.extend(account_labels)
-            
-            if start_date:
-                query += " AND timestamp >= %s"
-                params.append(start_date)
-            if end_date:
-                query += " AND timestamp <= %s"
-                params.append(end_date + " 23:59:59")
-            
-            query += " ORDER BY timestamp ASC"
-            cursor.execute(query, params)
-            
-            history = [dict(row) for row in cursor.fetchall()]
-            
-        else:
-            cursor = conn.cursor()
-            query = "SELECT timestamp, account_label, account_number, balance, event_type, broker, currency FROM balance_history WHERE 1=1"
-            params = []
-            
-            if account_labels and account_labels[0]:
-                placeholders = ','.join(['?'] * len(account_labels))
-                query += f" AND account_label IN ({placeholders})"
-                params.extend(account_labels)
-            
-            if start_date:
-                query += " AND timestamp >= ?"
-                params.append(start_date)
-            if end_date:
-                query += " AND timestamp <= ?"
-                params.append(end_date + " 23:59:59")
-            
-            query += " ORDER BY timestamp ASC"
-            cursor.execute(query, params)
-            
-            history = []
-            for row in cursor.fetchall():
-                history.append({
-                    "timestamp": row[0],
-                    "account_label": row[1],
-                    "account_number": row[2],
-                    "balance": row[3],
-                    "event_type": row[4],
-                    "broker": row[5],
-                    "currency": row[6]
-                })
-        
-        cursor.close()
-        conn.close()
-        return jsonify(history)
+        stream = generate()
+        # Run the query now so database errors still produce a 500 response
+        head = next(stream)
+        return Response(
+            stream_with_context(itertools.chain([head], stream)),
+            mimetype='application/json'
+        )
         
     except Exception as e:
-        print(f"✗ Error getting history: {str(e)}")
+        logger.error("✗ Error getting history: %s", e)
         return jsonify({"error": str(e)}), 500
 
 # ==================== HEALTH CHECK ====================
@@ -416,20 +744,20 @@ def health():
 
 # ==================== MAIN ====================
 if __name__ == '__main__':
-    print("\n" + "="*60)
-    print("🚀 Centralized MT5 Balance Monitoring System")
-    print("="*60)
+    logger.info("=" * 60)
+    logger.info("🚀 Centralized MT5 Balance Monitoring System")
+    logger.info("=" * 60)
     
-    init_database()
+    ensure_database()
     
-    print("\n⚙️  Configuration:")
-    print(f"   Database: {'PostgreSQL ✓' if USE_POSTGRES else 'SQLite'}")
-    print(f"   Telegram Bot: {'✓ Configured' if TELEGRAM_BOT_TOKEN else '✗ NOT CONFIGURED'}")
-    print(f"   Dashboard Password: {DASHBOARD_PASSWORD}")
+    logger.info("⚙️  Configuration:")
+    logger.info("   Database: %s", 'PostgreSQL ✓' if USE_POSTGRES else 'SQLite')
+    logger.info("   Telegram Bot: %s", '✓ Configured' if TELEGRAM_ENABLED else '✗ NOT CONFIGURED')
+    logger.info("   Dashboard Password: %s", DASHBOARD_PASSWORD)
     
     port = int(os.environ.get('PORT', 5000))
     
-    print(f"\n🌐 Server starting on port {port}")
-    print("="*60 + "\n")
+    logger.info("🌐 Server starting on port %s", port)
+    logger.info("=" * 60)
     
     app.run(host='0.0.0.0', port=port, debug=False)